@@ -1,9 +1,13 @@
 from typing import List, Optional
 import asyncio
-from fastapi import APIRouter, Query
-import aiosqlite, re, time
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import Response, StreamingResponse
+import aiosqlite, json
 from pathlib import Path
 from gritana.backend.services.dsl_parser import parse_dsl
+from gritana.backend.services import log_archive
+from gritana.backend.services.query_worker import QueryTimeout, WorkerUnavailable, query_objects_json, run_in_worker
+from gritana.backend.services.result_cache import etag_matches, make_etag, make_key, result_cache
 
 router = APIRouter(prefix="/ritual/logs", tags=["ritual"])
 
@@ -23,15 +27,60 @@ async def db_check():
 
 #asyncio.run(db_check())
 
+async def cached_response(request: Request, endpoint: str, params: dict, fetch):
+    """
+    Отдаёт результат fetch() — готовые JSON-байты — с ETag.
+
+    Ключ включает max(id): пока новых логов нет, ответ не меняется — на совпавший
+    If-None-Match сразу 304, без запроса и сериализации, иначе — из LRU-кэша.
+    """
+    # соединение только на high-water mark: запрос в воркере может идти секундами
+    async with aiosqlite.connect(DB_PATH) as db:
+        cursor = await db.execute("SELECT MAX(id) FROM logs")
+        hwm = (await cursor.fetchone())[0]
+
+    key = make_key(endpoint, params, hwm)
+    etag = make_etag(key)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    body = result_cache.get(key)
+    if body is None:
+        try:
+            body = await fetch()
+        except QueryTimeout as e:
+            raise HTTPException(status_code=504, detail=str(e))
+        except WorkerUnavailable as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        result_cache.put(key, body)
+
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+async def fetch_distinct(column: str, order: str = "", limit: Optional[int] = None, skip_empty: bool = True):
+    query = f"SELECT DISTINCT {column} FROM logs ORDER BY {column} {order}"
+    if limit is not None:
+        query += f" LIMIT {int(limit)}"
+    async with aiosqlite.connect(DB_PATH) as db:
+        db.row_factory = aiosqlite.Row
+        cursor = await db.execute(query)
+        rows = await cursor.fetchall()
+    values = [row[column] for row in rows if row[column] or not skip_empty]
+    return json.dumps(values, ensure_ascii=False).encode("utf-8")
+
+
 @router.get("/")
 async def get_logs(
+        request: Request,
         level: Optional[str] = None,
         source: Optional[str] = None,
         process: Optional[str] = None,
         module: Optional[str] = None,
         version: Optional[str] = None,
         event_run_id: Optional[str] = None,
-        limit: int = 1000
+        limit: int = 1000,
+        timeout: Optional[float] = None,
 ):
     query = "SELECT * FROM logs WHERE 1=1"
     params = []
@@ -58,51 +107,37 @@ async def get_logs(
     query += " ORDER BY timestamp DESC LIMIT ?"
     params.append(limit)
 
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute(query, params)
-        logs = await cursor.fetchall()
+    async def fetch():
+        return await run_in_worker(query_objects_json, DB_PATH, query, params, timeout=timeout)
 
-    return [dict(row) for row in logs]
+    key_params = {
+        "level": level, "source": source, "process": process, "module": module,
+        "version": version, "event_run_id": event_run_id, "limit": limit,
+    }
+    return await cached_response(request, "logs", key_params, fetch)
 
 @router.get("/levels")
 async def get_levels():
     return ["DEBUG", "INFO", "WARN", "ERROR", "CRITICAL"]
 
 @router.get("/modules")
-async def get_modules():
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        curor = await db.execute("SELECT DISTINCT module FROM logs ORDER BY module")
-        rows = await curor.fetchall()
-        return [row["module"] for row in rows]
+async def get_modules(request: Request):
+    return await cached_response(request, "modules", {}, lambda: fetch_distinct("module", skip_empty=False))
 
 @router.get("/sources")
-async def get_sources():
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute("SELECT DISTINCT source FROM logs ORDER BY source")
-        rows = await cursor.fetchall()
-        return [row["source"] for row in rows if row["source"]]
+async def get_sources(request: Request):
+    return await cached_response(request, "sources", {}, lambda: fetch_distinct("source"))
 
 @router.get("/processes")
-async def get_processes():
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute("SELECT DISTINCT process FROM logs ORDER BY process")
-        rows = await cursor.fetchall()
-        return [row["process"] for row in rows if row["process"]]
+async def get_processes(request: Request):
+    return await cached_response(request, "processes", {}, lambda: fetch_distinct("process"))
 
 @router.get("/versions")
-async def get_versions():
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute("SELECT DISTINCT version FROM logs ORDER BY version")
-        rows = await cursor.fetchall()
-        return [row["version"] for row in rows if row["version"]]
+async def get_versions(request: Request):
+    return await cached_response(request, "versions", {}, lambda: fetch_distinct("version"))
 
 @router.get("/stats")
-async def get_stats():
+async def get_stats(request: Request):
     query = """
     SELECT
         strftime('%Y-%m-%d %H:00', timestamp / 1000, 'unixepoch') as hour,
@@ -112,23 +147,25 @@ async def get_stats():
     ORDER BY hour DESC
     LIMIT 1000
     """
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute(query)
-        rows = await cursor.fetchall()
-        return [dict(row) for row in rows]
+
+    async def fetch():
+        return await run_in_worker(query_objects_json, DB_PATH, query, [])
+
+    return await cached_response(request, "stats", {}, fetch)
 
 @router.get("/event_run_ids")
-async def get_event_run_ids():
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute("SELECT DISTINCT event_run_id FROM logs ORDER BY event_run_id DESC LIMIT 100")
-        rows = await cursor.fetchall()
-        return [row["event_run_id"] for row in rows if row["event_run_id"]]
+async def get_event_run_ids(request: Request):
+    return await cached_response(
+        request, "event_run_ids", {},
+        lambda: fetch_distinct("event_run_id", order="DESC", limit=100),
+    )
 
 
 @router.get("/dsl")
-async def get_logs_dsl(q: str):
+async def get_logs_dsl(request: Request, q: str, timeout: Optional[float] = None):
+    """
+    timeout — секунды на запрос (не больше GRITANA_QUERY_TIMEOUT), иначе 504.
+    """
     where_clause, params, message_regex = parse_dsl(q)
 
     query = "SELECT * FROM logs"
@@ -136,15 +173,51 @@ async def get_logs_dsl(q: str):
         query += f" WHERE {where_clause}"
     query += " ORDER BY timestamp DESC LIMIT 1000"
 
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute(query, params)
-        rows = await cursor.fetchall()
+    async def fetch():
+        # Если есть message_regex, да будут забыты еретические логи — но уже в воркере
+        return await run_in_worker(
+            query_objects_json, DB_PATH, query, params, timeout=timeout, message_regex=message_regex,
+        )
+
+    return await cached_response(request, "dsl", {"q": q}, fetch)
+
+
+@router.get("/cache")
+async def get_cache_stats():
+    return result_cache.stats()
 
-    # Если есть message_regex, да будут забыты еретические логи
-    if message_regex is not None:
-        pattern = re.compile(message_regex)
-        filtered = [dict(r) for r in rows if pattern.search(r["message"] or "")]
-        return filtered
-    else:
-        return [dict(r) for r in rows]
\ No newline at end of file
+@router.delete("/cache")
+async def clear_cache():
+    result_cache.clear()
+    return result_cache.stats()
+
+
+@router.get("/export")
+async def export_logs(
+        q: Optional[str] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        format: str = "ndjson",
+        compression: str = "gzip",
+):
+    """
+    Потоковая выгрузка диапазона логов без лимита в 1000 строк.
+    since/until — ISO-время, q — DSL-фильтр, как у /dsl.
+    """
+    try:
+        log_archive.check_options(format, compression)
+        await log_archive.validate_export(DB_PATH, q, since, until)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    filename = log_archive.archive_filename(format, compression)
+    media_type = {
+        "gzip": "application/gzip",
+        "zstd": "application/zstd",
+    }.get(compression, "application/x-ndjson" if format == "ndjson" else "text/csv")
+
+    return StreamingResponse(
+        log_archive.iter_export(DB_PATH, q=q, since=since, until=until, fmt=format, compression=compression),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
@@ -0,0 +1,255 @@
+import argparse
+import asyncio
+import random
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+
+from gritana.backend.services import log_archive
+
+# Путь не тот, что ты видишь — путь тот, что исполняется.
+CURRENT_DIR = Path(__file__).parent
+PROJECT_ROOT = CURRENT_DIR.parent.parent
+
+DB_PATH = PROJECT_ROOT / "logs" / "logs.db"
+
+
+def cmd_export(args):
+    output = args.output or log_archive.archive_filename(args.format, args.compression)
+    started = time.perf_counter()
+    written = asyncio.run(log_archive.export_to_file(
+        output,
+        args.db,
+        q=args.q,
+        since=args.since,
+        until=args.until,
+        fmt=args.format,
+        compression=args.compression,
+        batch_size=args.batch_size,
+    ))
+    elapsed = time.perf_counter() - started
+    print(f"→ {output}: {written} bytes за {elapsed:.2f}s")
+
+
+def cmd_import(args):
+    if Path(args.db).resolve() == DB_PATH.resolve():
+        raise SystemExit("error: import goes into a scratch database, not logs.db")
+    started = time.perf_counter()
+    total = asyncio.run(log_archive.import_archive(args.archive, args.db, batch_size=args.batch_size))
+    elapsed = time.perf_counter() - started
+    print(f"→ {args.db}: загружено {total} строк за {elapsed:.2f}s")
+
+
+def _seed_bench_db(path: Path, rows: int, traceback_size: int = 0):
+    levels = ["DEBUG", "INFO", "WARN", "ERROR", "CRITICAL"]
+    modules = ["main", "discord_bot", "ai/logic.py", "utils/logger.py"]
+    start_ms = int(time.time() * 1000) - rows * 10
+    traceback_text = "Traceback (most recent call last):\n" + "  File \"x.py\", line 1, in f\n" * max(traceback_size // 32, 1)
+
+    def generate():
+        for i in range(rows):
+            level = random.choice(levels)
+            yield (
+                start_ms + i * 10, level, "orion", "main", random.choice(modules), "0.1",
+                f"bench message #{i} failed={level == 'ERROR'}",
+                traceback_text if level == "ERROR" else None,
+                "bench-run", '{"logger": "bench"}',
+            )
+
+    with sqlite3.connect(path) as db:
+        db.execute(log_archive.SQL_CREATE_TABLE)
+        db.executemany(
+            "INSERT INTO logs (timestamp, level, source, process, module, version, message, "
+            "traceback, event_run_id, context) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            generate(),
+        )
+
+
+def cmd_bench(args):
+    """
+    Меряет пропускную способность выгрузки на синтетической базе из N строк.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        db_path = tmp / "bench.db"
+        print(f"→ засеваем {args.rows} строк...")
+        _seed_bench_db(db_path, args.rows)
+
+        for fmt in ("ndjson", "csv"):
+            for compression in ("none", "gzip", "zstd"):
+                try:
+                    log_archive.check_options(fmt, compression)
+                except ValueError as e:
+                    print(f"{fmt:>6} / {compression:<5} пропущено: {e}")
+                    continue
+                output = tmp / log_archive.archive_filename(fmt, compression)
+                started = time.perf_counter()
+                written = asyncio.run(log_archive.export_to_file(
+                    output, db_path, q=args.q, fmt=fmt, compression=compression,
+                ))
+                elapsed = time.perf_counter() - started
+                print(
+                    f"{fmt:>6} / {compression:<5} {elapsed:7.2f}s  "
+                    f"{args.rows / elapsed:10.0f} rows/s  {written / 2**20:8.1f} MiB"
+                )
+                output.unlink()
+
+
+def _percentiles(samples):
+    samples = sorted(samples)
+    if not samples:
+        return "нет данных"
+    pick = lambda p: samples[min(len(samples) - 1, int(len(samples) * p))] * 1000
+    return (
+        f"n={len(samples):5d}  p50={pick(0.50):7.1f}ms  p95={pick(0.95):7.1f}ms  "
+        f"p99={pick(0.99):7.1f}ms  max={samples[-1] * 1000:7.1f}ms"
+    )
+
+
+async def _loadtest(args, db_path: Path):
+    import aiohttp
+    import uvicorn
+    from gritana.backend.api import logs as logs_api
+    from gritana.backend.main import app
+
+    logs_api.DB_PATH = db_path
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=args.port, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    base = f"http://127.0.0.1:{args.port}/ritual/logs"
+    # группы отчитываются отдельно: статика меряет только event loop, измерения — aiosqlite,
+    # а "/" и "/stats" идут через тот же пул воркеров, что и тяжёлые DSL
+    probe_groups = {
+        "статика /levels": [("/levels", None)],
+        "измерения": [("/sources", None), ("/event_run_ids", None)],
+        "пул: / и /stats": [("/", {"limit": "50"}), ("/stats", None)],
+    }
+    writer = sqlite3.connect(db_path, check_same_thread=False)
+
+    def bump_high_water_mark():
+        # новая строка меняет max(id) — опрос идёт мимо кэша, как у UI при живом потоке логов
+        writer.execute(
+            "INSERT INTO logs (timestamp, level, module, message) VALUES (?, 'INFO', 'loadtest', 'probe')",
+            (int(time.time() * 1000),),
+        )
+        writer.commit()
+
+    async def probe_group(session, paths, stop_at, bypass_cache):
+        samples = []
+        i = 0
+        while time.perf_counter() < stop_at:
+            path, params = paths[i % len(paths)]
+            if bypass_cache:
+                await asyncio.to_thread(bump_high_water_mark)
+            started = time.perf_counter()
+            async with session.get(base + path, params=params) as resp:
+                await resp.read()
+            samples.append(time.perf_counter() - started)
+            i += 1
+            await asyncio.sleep(0.005)
+        return samples
+
+    async def probe(session, stop_at):
+        # группы крутятся параллельно, чтобы медленная не съедала выборку быстрой
+        results = await asyncio.gather(*(
+            probe_group(session, paths, stop_at, bypass_cache=name.startswith("пул"))
+            for name, paths in probe_groups.items()
+        ))
+        return dict(zip(probe_groups, results))
+
+    def report(title, samples):
+        print(title)
+        for name, values in samples.items():
+            print(f"  {name:<18} {_percentiles(values)}")
+
+    async def heavy(session, worker_id, stop_at):
+        done = 0
+        while time.perf_counter() < stop_at:
+            # каждый запрос уникален — мимо кэша, всегда до SQLite и обратно
+            q = f'level:ERROR AND message:"#{worker_id}{done}|failed"'
+            async with session.get(base + "/dsl", params={"q": q}) as resp:
+                await resp.read()
+            done += 1
+        return done
+
+    try:
+        async with aiohttp.ClientSession() as session:
+            await probe(session, time.perf_counter() + 1)  # прогрев: пул, кэш измерений
+
+            baseline = await probe(session, time.perf_counter() + args.duration)
+            report("без нагрузки:", baseline)
+
+            stop_at = time.perf_counter() + args.duration
+            heavy_tasks = [asyncio.create_task(heavy(session, n, stop_at)) for n in range(args.heavy)]
+            loaded = await probe(session, stop_at)
+            heavy_done = sum(await asyncio.gather(*heavy_tasks))
+            report(f"под {args.heavy} тяжёлыми DSL:", loaded)
+            print(f"тяжёлых DSL-запросов выполнено: {heavy_done} ({heavy_done / args.duration:.1f}/s)")
+    finally:
+        writer.close()
+        server.should_exit = True
+        await server_task
+
+
+def cmd_loadtest(args):
+    """
+    Поднимает API на синтетической базе и меряет латентность опрашиваемых UI
+    эндпоинтов до и во время параллельных тяжёлых DSL-запросов.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "loadtest.db"
+        print(f"→ засеваем {args.rows} строк (traceback ~{args.traceback_size} байт у ERROR)...")
+        _seed_bench_db(db_path, args.rows, traceback_size=args.traceback_size)
+        asyncio.run(_loadtest(args, db_path))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m gritana.backend.cli", description="Gritana: выгрузка и загрузка логов")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    export = sub.add_parser("export", help="выгрузить диапазон логов в сжатый архив")
+    export.add_argument("--db", default=DB_PATH, help="путь к logs.db")
+    export.add_argument("-q", "--q", default=None, help="DSL-фильтр, как в /ritual/logs/dsl")
+    export.add_argument("--since", default=None, help="начало диапазона (ISO), включительно")
+    export.add_argument("--until", default=None, help="конец диапазона (ISO), не включительно")
+    export.add_argument("--format", choices=sorted(log_archive.FORMATS), default="ndjson")
+    export.add_argument("--compression", choices=sorted(log_archive.COMPRESSIONS), default="gzip")
+    export.add_argument("--batch-size", type=int, default=log_archive.BATCH_SIZE)
+    export.add_argument("-o", "--output", default=None, help="файл архива (по умолчанию logs.<format>.<ext>)")
+    export.set_defaults(func=cmd_export)
+
+    imp = sub.add_parser("import", help="загрузить архив в отдельную базу для расследования")
+    imp.add_argument("archive", help="файл архива: *.ndjson[.gz|.zst] или *.csv[.gz|.zst]")
+    imp.add_argument("--db", required=True, help="scratch-база, куда грузить (не logs.db)")
+    imp.add_argument("--batch-size", type=int, default=log_archive.BATCH_SIZE)
+    imp.set_defaults(func=cmd_import)
+
+    bench = sub.add_parser("bench", help="замерить скорость выгрузки на синтетических данных")
+    bench.add_argument("--rows", type=int, default=2_000_000)
+    bench.add_argument("-q", "--q", default=None, help="DSL-фильтр для замера")
+    bench.set_defaults(func=cmd_bench)
+
+    load = sub.add_parser("loadtest", help="латентность дешёвых эндпоинтов под тяжёлыми DSL-запросами")
+    load.add_argument("--rows", type=int, default=200_000)
+    load.add_argument("--traceback-size", type=int, default=16_384)
+    load.add_argument("--heavy", type=int, default=4, help="сколько тяжёлых DSL-запросов держать параллельно")
+    load.add_argument("--duration", type=float, default=10.0, help="секунд на каждую фазу")
+    load.add_argument("--port", type=int, default=8765)
+    load.set_defaults(func=cmd_loadtest)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        args.func(args)
+    except ValueError as e:
+        raise SystemExit(f"error: {e}")
+
+
+if __name__ == "__main__":
+    main()
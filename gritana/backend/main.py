@@ -1,9 +1,20 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from pathlib import Path
 from gritana.backend.api.logs import router as logs_router
+from gritana.backend.services.query_worker import shutdown_pool, start_pool
 from fastapi.middleware.cors import CORSMiddleware
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # пул создаём до первого запроса, а не посреди него
+    start_pool()
+    yield
+    # воркеры запросов не должны пережить сервер
+    shutdown_pool()
+
+app = FastAPI(lifespan=lifespan)
 
 # Путь не тот, что ты видишь — путь тот, что исполняется.
 CURRENT_DIR = Path(__file__).parent
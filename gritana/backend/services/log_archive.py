@@ -0,0 +1,314 @@
+import asyncio
+import csv
+import datetime
+import gzip
+import io
+import json
+import re
+import sqlite3
+import zlib
+from pathlib import Path
+from typing import AsyncIterator, Optional
+
+import aiosqlite
+
+from gritana.backend.services.dsl_parser import parse_dsl
+from gritana.backend.services.query_worker import encode_rows, readonly_uri
+
+try:
+    import zstandard
+except ImportError:  # zstd — опциональный обряд, gzip есть всегда
+    zstandard = None
+
+
+COLUMNS = (
+    "id", "timestamp", "level", "source", "process", "module",
+    "version", "message", "traceback", "event_run_id", "context",
+)
+
+FORMATS = {"ndjson", "csv"}
+COMPRESSIONS = {"gzip", "zstd", "none"}
+EXTENSIONS = {"gzip": ".gz", "zstd": ".zst", "none": ""}
+
+BATCH_SIZE = 5000
+
+# CSV не различает NULL и пустую строку — делаем как COPY в Postgres: NULL пишем
+# маркером \N, а обратный слэш в данных удваиваем, чтобы строка "\N" маркером не стала
+CSV_NULL = "\\N"
+
+SQL_CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS logs (
+    id              INTEGER     PRIMARY KEY AUTOINCREMENT,
+    timestamp       INTEGER     NOT NULL,
+    level           TEXT        NOT NULL,
+    source          TEXT,
+    process         TEXT,
+    module          TEXT        NOT NULL,
+    version         TEXT,
+    message         TEXT        NOT NULL,
+    traceback       TEXT,
+    event_run_id    TEXT,
+    context         TEXT
+);
+"""
+
+
+def _to_ms(value: Optional[str]) -> Optional[int]:
+    if not value:
+        return None
+    dt = datetime.datetime.fromisoformat(value)
+    return int(dt.timestamp() * 1000)
+
+
+def build_export_query(q: Optional[str] = None, since: Optional[str] = None, until: Optional[str] = None):
+    """
+    Собирает SQL для выгрузки диапазона: DSL-фильтр + полуинтервал [since, until).
+
+    Возвращает (query, params, message_regex). Порядок — по id, чтобы SQLite
+    шёл по первичному ключу и не строил сортировку на миллионах строк.
+    """
+    where_parts = []
+    params = []
+    message_regex = None
+
+    if q:
+        where_clause, dsl_params, message_regex = parse_dsl(q)
+        if where_clause:
+            where_parts.append(f"({where_clause})")
+            params.extend(dsl_params)
+
+    since_ms = _to_ms(since)
+    if since_ms is not None:
+        where_parts.append("timestamp >= ?")
+        params.append(since_ms)
+
+    until_ms = _to_ms(until)
+    if until_ms is not None:
+        where_parts.append("timestamp < ?")
+        params.append(until_ms)
+
+    query = f"SELECT {', '.join(COLUMNS)} FROM logs"
+    if where_parts:
+        query += " WHERE " + " AND ".join(where_parts)
+    query += " ORDER BY id"
+    return query, params, message_regex
+
+
+def check_options(fmt: str, compression: str):
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression: {compression}")
+    if compression == "zstd" and zstandard is None:
+        raise ValueError("zstd compression requires the 'zstandard' package")
+
+
+async def validate_export(db_path, q: Optional[str] = None, since: Optional[str] = None, until: Optional[str] = None):
+    """
+    Проверяет выгрузку до первого байта: время, регулярку и сам SQL (через EXPLAIN).
+
+    Стрим после отправки заголовков уже не откатить — ошибка там превращается
+    в обрезанный архив со статусом 200. Всё, что может упасть, падает здесь как ValueError.
+    """
+    query, params, message_regex = build_export_query(q, since, until)
+    if message_regex is not None:
+        try:
+            re.compile(message_regex)
+        except re.error as e:
+            raise ValueError(f"Invalid message regex: {e}")
+    if not Path(db_path).is_file():
+        raise ValueError(f"Database not found: {db_path}")
+    async with aiosqlite.connect(readonly_uri(db_path), uri=True) as db:
+        try:
+            await db.execute(f"EXPLAIN {query}", params)
+        except sqlite3.Error as e:
+            raise ValueError(f"Invalid query: {e}")
+
+
+def archive_filename(fmt: str, compression: str, stem: str = "logs") -> str:
+    return f"{stem}.{fmt}{EXTENSIONS[compression]}"
+
+
+class _Passthrough:
+    def compress(self, data: bytes) -> bytes:
+        return data
+
+    def flush(self) -> bytes:
+        return b""
+
+
+def _compressor(compression: str):
+    if compression == "gzip":
+        # wbits=31 — полноценный gzip-контейнер, читается обычным gunzip
+        return zlib.compressobj(6, zlib.DEFLATED, 31)
+    if compression == "zstd":
+        return zstandard.ZstdCompressor(level=3).compressobj()
+    return _Passthrough()
+
+
+def _encode_ndjson(rows) -> bytes:
+    lines = encode_rows(COLUMNS, rows)
+    lines.append("")
+    return "\n".join(lines).encode("utf-8")
+
+
+def _csv_field(value):
+    if value is None:
+        return CSV_NULL
+    if value.__class__ is str and "\\" in value:
+        return value.replace("\\", "\\\\")
+    return value
+
+
+def _encode_csv(rows) -> bytes:
+    buf = io.StringIO()
+    csv.writer(buf, lineterminator="\n").writerows([_csv_field(value) for value in row] for row in rows)
+    return buf.getvalue().encode("utf-8")
+
+
+async def iter_export(
+        db_path,
+        q: Optional[str] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        fmt: str = "ndjson",
+        compression: str = "gzip",
+        batch_size: int = BATCH_SIZE,
+) -> AsyncIterator[bytes]:
+    """
+    Потоково выгружает логи пачками по batch_size строк и отдаёт сжатые куски.
+
+    В памяти одновременно живёт только одна пачка — размер диапазона не важен.
+    """
+    check_options(fmt, compression)
+    query, params, message_regex = build_export_query(q, since, until)
+    pattern = re.compile(message_regex) if message_regex is not None else None
+    message_idx = COLUMNS.index("message")
+    encode = _encode_ndjson if fmt == "ndjson" else _encode_csv
+    compressor = _compressor(compression)
+
+    if fmt == "csv":
+        chunk = compressor.compress(_encode_csv([COLUMNS]))
+        if chunk:
+            yield chunk
+
+    def process_batch(rows) -> bytes:
+        if pattern is not None:
+            rows = [r for r in rows if pattern.search(r[message_idx] or "")]
+            if not rows:
+                return b""
+        return compressor.compress(encode(rows))
+
+    async with aiosqlite.connect(readonly_uri(db_path), uri=True) as db:
+        cursor = await db.execute(query, params)
+        while True:
+            rows = await cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            # фильтрация, кодирование и сжатие пачки — не на event loop
+            chunk = await asyncio.to_thread(process_batch, rows)
+            if chunk:
+                yield chunk
+
+    tail = compressor.flush()
+    if tail:
+        yield tail
+
+
+async def export_to_file(path, db_path, **kwargs) -> int:
+    """
+    Пишет выгрузку в файл, возвращает число записанных байт.
+    """
+    await validate_export(db_path, kwargs.get("q"), kwargs.get("since"), kwargs.get("until"))
+    written = 0
+    with open(path, "wb") as fh:
+        async for chunk in iter_export(db_path, **kwargs):
+            fh.write(chunk)
+            written += len(chunk)
+    return written
+
+
+def detect_archive(path) -> tuple[str, str]:
+    """
+    По имени файла определяет (format, compression): logs.ndjson.gz, logs.csv.zst, logs.csv ...
+    """
+    suffixes = Path(path).suffixes
+    compression = "none"
+    if suffixes and suffixes[-1] in (".gz", ".zst"):
+        compression = "gzip" if suffixes[-1] == ".gz" else "zstd"
+        suffixes = suffixes[:-1]
+    fmt = suffixes[-1].lstrip(".") if suffixes else ""
+    check_options(fmt, compression)
+    return fmt, compression
+
+
+def _open_text(path, compression: str):
+    if compression == "gzip":
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    if compression == "zstd":
+        raw = open(path, "rb")
+        reader = zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+        return io.TextIOWrapper(reader, encoding="utf-8", newline="")
+    return open(path, "r", encoding="utf-8", newline="")
+
+
+def _iter_archive_rows(fh, fmt: str):
+    if fmt == "ndjson":
+        for line in fh:
+            line = line.strip()
+            if line:
+                record = json.loads(line)
+                yield tuple(record.get(col) for col in COLUMNS)
+        return
+
+    reader = csv.reader(fh)
+    header = next(reader, None)
+    if header is None:
+        return
+    positions = [header.index(col) if col in header else None for col in COLUMNS]
+    int_columns = {COLUMNS.index("id"), COLUMNS.index("timestamp")}
+    for raw in reader:
+        row = []
+        for i, pos in enumerate(positions):
+            value = raw[pos] if pos is not None else CSV_NULL
+            if value == CSV_NULL:
+                value = None
+            elif i in int_columns:
+                value = int(value)
+            elif "\\" in value:
+                value = value.replace("\\\\", "\\")
+            row.append(value)
+        yield tuple(row)
+
+
+async def import_archive(archive_path, db_path, batch_size: int = BATCH_SIZE) -> int:
+    """
+    Загружает архив выгрузки в отдельную (scratch) базу для расследований.
+
+    Схема та же, что у logs.db; id сохраняются, повторная загрузка того же
+    архива дубликатов не плодит. Возвращает число реально вставленных строк —
+    INSERT OR IGNORE молча пропускает и дубликаты, и нарушения NOT NULL.
+    """
+    fmt, compression = detect_archive(archive_path)
+    insert = (
+        f"INSERT OR IGNORE INTO logs ({', '.join(COLUMNS)}) "
+        f"VALUES ({', '.join('?' for _ in COLUMNS)})"
+    )
+    with _open_text(archive_path, compression) as fh:
+        async with aiosqlite.connect(db_path) as db:
+            await db.execute("PRAGMA journal_mode = WAL")
+            await db.execute("PRAGMA synchronous = OFF")
+            await db.execute(SQL_CREATE_TABLE)
+            changes_before = db.total_changes
+            batch = []
+            for row in _iter_archive_rows(fh, fmt):
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    await db.executemany(insert, batch)
+                    batch = []
+            if batch:
+                await db.executemany(insert, batch)
+            total = db.total_changes - changes_before
+            await db.commit()
+
+    return total
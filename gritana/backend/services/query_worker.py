@@ -0,0 +1,303 @@
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import re
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from json.encoder import encode_basestring
+from pathlib import Path
+from typing import Optional, Sequence
+
+
+def _env_float(name: str, default: float) -> float:
+    v = os.getenv(name)
+    if v is None or not v.strip():
+        return default
+    return float(v)
+
+
+def _env_int(name: str, default: int) -> int:
+    v = os.getenv(name)
+    if v is None or not v.strip():
+        return default
+    return int(v)
+
+
+QUERY_TIMEOUT = _env_float("GRITANA_QUERY_TIMEOUT", 10.0)
+QUERY_WORKERS = _env_int("GRITANA_QUERY_WORKERS", min(4, os.cpu_count() or 1))
+
+# как часто (в инструкциях VM SQLite) проверять дедлайн внутри запроса
+_PROGRESS_STEPS = 10_000
+_DEADLINE_CHECK_ROWS = 256
+
+
+class QueryTimeout(Exception):
+    pass
+
+
+def encode_value(value) -> str:
+    if value is None:
+        return "null"
+    cls = value.__class__
+    if cls is str:
+        return encode_basestring(value)
+    if cls is int:
+        return int.__repr__(value)
+    return json.dumps(value, ensure_ascii=False)
+
+
+def encode_rows(columns: Sequence[str], rows) -> list[str]:
+    """
+    Кортежи → JSON-объекты строками, минуя dict: ключи склеены заранее.
+    """
+    keys = ['{"%s":' % columns[0]] + [',"%s":' % col for col in columns[1:]]
+    out = []
+    for row in rows:
+        parts = []
+        for key, value in zip(keys, row):
+            parts.append(key)
+            parts.append(encode_value(value))
+        parts.append("}")
+        out.append("".join(parts))
+    return out
+
+
+def readonly_uri(db_path) -> str:
+    # mode=ro: чтение не должно молча создавать пустую базу по опечатке в пути
+    return Path(db_path).resolve().as_uri() + "?mode=ro"
+
+
+def _connect(db_path, deadline: float) -> sqlite3.Connection:
+    db = sqlite3.connect(readonly_uri(db_path), uri=True)
+
+    # SQLite сам прервёт запрос (OperationalError: interrupted), если дедлайн прошёл
+    def check_deadline():
+        return 1 if time.time() > deadline else 0
+
+    db.set_progress_handler(check_deadline, _PROGRESS_STEPS)
+    return db
+
+
+def _fetch(db_path, query: str, params: list, deadline: float):
+    db = _connect(db_path, deadline)
+    try:
+        cursor = db.execute(query, params)
+        columns = [d[0] for d in cursor.description]
+        return columns, cursor.fetchall()
+    except sqlite3.OperationalError as e:
+        if time.time() > deadline:
+            raise QueryTimeout(f"query interrupted by deadline ({e})")
+        raise
+    finally:
+        db.close()
+
+
+def query_objects_json(
+        db_path,
+        query: str,
+        params: list,
+        deadline: float,
+        message_regex: Optional[str] = None,
+) -> bytes:
+    """
+    Выполняет запрос в воркере и отдаёт сразу JSON-массив объектов в байтах.
+
+    message_regex фильтрует по колонке message — здесь же, до сериализации.
+    """
+    columns, rows = _fetch(db_path, query, params, deadline)
+
+    if message_regex is not None:
+        search = re.compile(message_regex).search
+        message_idx = columns.index("message")
+        filtered = []
+        for i, row in enumerate(rows):
+            if i % _DEADLINE_CHECK_ROWS == 0 and time.time() > deadline:
+                raise QueryTimeout("message regex filtering exceeded the deadline")
+            if search(row[message_idx] or ""):
+                filtered.append(row)
+        rows = filtered
+
+    return ("[" + ",".join(encode_rows(columns, rows)) + "]").encode("utf-8")
+
+
+class WorkerUnavailable(Exception):
+    pass
+
+
+class _WorkerDied(Exception):
+    pass
+
+
+def _worker_main(conn) -> None:
+    """
+    Цикл воркера: получить задачу, выполнить, отправить (ok, результат).
+    """
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        func, args, kwargs, deadline = job
+        try:
+            reply = (True, func(*args, deadline=deadline, **kwargs))
+        except Exception as e:
+            reply = (False, e)
+        try:
+            conn.send(reply)
+        except Exception:
+            # исключение не пиклится — отдаём хотя бы текст
+            conn.send((False, RuntimeError(repr(reply[1]))))
+
+
+def _mp_context():
+    # fork из процесса с живыми потоками aiosqlite может унести чужой захваченный лок — не форкаем
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+class _Worker:
+    def __init__(self, ctx):
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child,), name="gritana-query-worker", daemon=True)
+        self.process.start()
+        child.close()
+
+    def roundtrip(self, job):
+        try:
+            self.conn.send(job)
+            return self.conn.recv()
+        except (EOFError, OSError) as e:
+            raise _WorkerDied(str(e))
+
+    def kill(self) -> None:
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join(timeout=1)
+        self.conn.close()
+
+
+class WorkerPool:
+    """
+    Пул процессов, где у каждой задачи свой воркер.
+
+    ProcessPoolExecutor при смерти любого воркера объявляет сломанным весь пул,
+    так что убить одну зависшую регулярку, не задев чужие запросы, он не даёт.
+    Здесь воркер с просроченной или отменённой задачей убивается и заменяется
+    новым, остальные продолжают работать.
+    """
+
+    def __init__(self, size: int):
+        self.ctx = _mp_context()
+        self.closed = False
+        # по потоку на ожидание ответа; запас — под потоки убиваемых воркеров
+        self.threads = ThreadPoolExecutor(max_workers=size * 2, thread_name_prefix="gritana-query")
+        self.workers = {_Worker(self.ctx) for _ in range(size)}
+        self.idle: asyncio.Queue = asyncio.Queue()
+        for worker in self.workers:
+            self.idle.put_nowait(worker)
+
+    def _respawn(self, worker: _Worker) -> Optional[_Worker]:
+        worker.kill()
+        self.workers.discard(worker)
+        if self.closed:
+            return None
+        fresh = _Worker(self.ctx)
+        self.workers.add(fresh)
+        return fresh
+
+    async def _replace(self, worker: _Worker) -> None:
+        loop = asyncio.get_running_loop()
+        fresh = await loop.run_in_executor(None, self._respawn, worker)
+        if fresh is not None:
+            self.idle.put_nowait(fresh)
+
+    async def run(self, func, args, kwargs, deadline: float, timeout: float) -> bytes:
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                worker = await asyncio.wait_for(self.idle.get(), max(deadline - time.time(), 0))
+            except asyncio.TimeoutError:
+                raise QueryTimeout(f"query exceeded {timeout:g}s waiting for a free worker")
+            if worker.process.is_alive():
+                break
+            # умер, пока простаивал (OOM-killer не спрашивает) — меняем, не тратя попытку
+            await self._replace(worker)
+
+        future = loop.run_in_executor(self.threads, worker.roundtrip, (func, args, kwargs, deadline))
+        try:
+            # небольшой запас: пусть воркер сам сообщит о дедлайне, если успеет
+            ok, result = await asyncio.wait_for(future, max(deadline - time.time(), 0) + 1.0)
+        except asyncio.TimeoutError:
+            await self._replace(worker)
+            raise QueryTimeout(f"query exceeded {timeout:g}s")
+        except _WorkerDied:
+            await self._replace(worker)
+            raise
+        except asyncio.CancelledError:
+            # клиент ушёл — воркер ещё занят его задачей, в пул его не вернуть
+            loop.create_task(self._replace(worker))
+            raise
+
+        self.idle.put_nowait(worker)
+        if not ok:
+            raise result
+        return result
+
+    def shutdown(self) -> None:
+        self.closed = True
+        for worker in list(self.workers):
+            worker.kill()
+        self.workers.clear()
+        self.threads.shutdown(wait=False, cancel_futures=True)
+
+
+_pool: Optional[WorkerPool] = None
+
+
+def start_pool() -> WorkerPool:
+    """
+    Поднимает пул воркеров; вызывать на старте приложения (lifespan).
+    """
+    global _pool
+    if _pool is None:
+        _pool = WorkerPool(QUERY_WORKERS)
+    return _pool
+
+
+def get_pool() -> WorkerPool:
+    # запасной путь для CLI и тестов без lifespan
+    return _pool if _pool is not None else start_pool()
+
+
+def shutdown_pool() -> None:
+    global _pool
+    if _pool is not None:
+        pool, _pool = _pool, None
+        pool.shutdown()
+
+
+async def run_in_worker(func, *args, timeout: Optional[float] = None, **kwargs) -> bytes:
+    """
+    Запускает func(*args, deadline=..., **kwargs) в отдельном процессе пула.
+
+    Таймаут превращается в дедлайн внутри воркера: запрос SQLite и фильтрация
+    прерываются сами. Но одна катастрофическая регулярка дедлайн не проверяет —
+    если воркер не ответил и с запасом, убивается только он.
+    Умерший воркер (OOM, segfault) заменяется, задача повторяется один раз.
+    """
+    # nan/inf проходят любые сравнения — без isfinite дедлайн стал бы nan
+    if timeout is None or not math.isfinite(timeout) or not 0 < timeout <= QUERY_TIMEOUT:
+        timeout = QUERY_TIMEOUT
+    deadline = time.time() + timeout
+
+    for attempt in range(2):
+        try:
+            return await get_pool().run(func, args, kwargs, deadline, timeout)
+        except _WorkerDied:
+            continue
+    raise WorkerUnavailable("query worker died twice in a row")
@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from typing import Optional
+
+
+def _env_int(name: str, default: int) -> int:
+    v = os.getenv(name)
+    if v is None or not v.strip():
+        return default
+    return int(v)
+
+
+def make_key(endpoint: str, params: dict, hwm: Optional[int]) -> str:
+    """
+    Ключ кэша: эндпоинт + нормализованные параметры + high-water mark (max id).
+
+    None и пустые параметры выбрасываются — `?level=ERROR&source=` и
+    `?level=ERROR` фильтруют одинаково и должны попадать в одну ячейку.
+    Сами значения не трогаем: пробелы в DSL — часть регулярки.
+    """
+    normalized = {}
+    for name, value in params.items():
+        if value is None or value == "":
+            continue
+        normalized[name] = value
+    return json.dumps([endpoint, sorted(normalized.items()), hwm], ensure_ascii=False, separators=(",", ":"))
+
+
+def make_etag(key: str) -> str:
+    # ключ уже включает max(id) — значит и ETag меняется ровно тогда, когда появляются новые логи
+    return '"' + hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+class ResultCache:
+    """
+    LRU-кэш готовых JSON-ответов, ограниченный суммарным размером в байтах.
+
+    Живёт в процессе и трогается только из event loop, поэтому без блокировок.
+    """
+
+    def __init__(self, max_bytes: int, max_entry_bytes: Optional[int] = None):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes if max_entry_bytes is not None else max_bytes // 4
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[bytes]:
+        body = self._entries.get(key)
+        if body is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return body
+
+    def put(self, key: str, body: bytes) -> None:
+        if len(body) > self.max_entry_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.size -= len(old)
+        self._entries[key] = body
+        self.size += len(body)
+        while self.size > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.size = 0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+result_cache = ResultCache(max_bytes=_env_int("GRITANA_CACHE_MAX_BYTES", 64 * 1024 * 1024))